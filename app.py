@@ -1,18 +1,58 @@
 import os
 import base64
+import ipaddress
+import json
+import logging
+import threading
+import time
 from datetime import datetime, date, timezone, timedelta
 import requests
-from flask import Flask, redirect, request, session, render_template, url_for
-from functools import wraps
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from flask import Flask, g, redirect, request, session, render_template, url_for
+from werkzeug.middleware.proxy_fix import ProxyFix
+from functools import lru_cache, wraps
+from operator import itemgetter
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 app.secret_key = os.environ.get('FLASK_SECRET_KEY', 'dev-secret-key-change-in-production')
 
+# Render のリバースプロキシ1段の配下で動くため、X-Forwarded-For / -Proto は
+# werkzeug に解釈させる。以降 request.remote_addr がそのままクライアントIPになり、
+# クライアントが勝手に付けた X-Forwarded-For 値は信用されない
+app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1)
+
+# REDIS_URL が設定されていればセッションをサーバーサイド（Redis）に置く。
+# Cookieはセッションidだけになり、毎リクエストのユーザーdictの署名/デコードと、
+# アクセストークンがCookieに載って往復するのを避けられる。未設定なら従来どおり
+# 署名付きCookieセッションで動く
+_redis_url = os.environ.get('REDIS_URL')
+if _redis_url:
+    import redis
+    from flask_session import Session
+
+    app.config.update(
+        SESSION_TYPE='redis',
+        SESSION_REDIS=redis.Redis.from_url(_redis_url),
+        SESSION_PERMANENT=False,
+    )
+    Session(app)
+
 # Slack App credentials
 SLACK_CLIENT_ID = os.environ.get('SLACK_CLIENT_ID')
 SLACK_CLIENT_SECRET = os.environ.get('SLACK_CLIENT_SECRET')
 SLACK_BOT_TOKEN = os.environ.get('SLACK_BOT_TOKEN')
 
+# 必須の環境変数は起動時に一度だけ確認し、実行中に個別チェックを散らばらせない
+# （HRMOS連携再開時は HRMOS_COMPANY_URL / HRMOS_API_SECRET もここに追加する）
+for _name in ('SLACK_CLIENT_ID', 'SLACK_CLIENT_SECRET', 'SLACK_BOT_TOKEN'):
+    if not os.environ.get(_name):
+        logger.warning("environment variable %s is not set", _name)
+del _name
+
 # ============== HRMOS連携は一時停止中 ==============
 # HRMOS API credentials
 # HRMOS_COMPANY_URL = os.environ.get('HRMOS_COMPANY_URL')
@@ -26,14 +66,30 @@ OFFICE_IPS = {
     '143.189.212.172': {'name': '立川オフィス', 'emoji': ':cityscape:', 'status': '立川オフィスで勤務中'},
 }
 
+# 判定用にネットワークオブジェクトへ展開しておく
+# （単一IPのほかCIDR表記のオフィスサブネットもそのまま登録できる）
+_OFFICE_NETS = [(ipaddress.ip_network(ip), info) for ip, info in OFFICE_IPS.items()]
+
 # Other work locations (for unknown IPs)
 OTHER_LOCATIONS = {
     'remote': {'name': 'リモートワーク', 'emoji': ':heads-down:', 'status': 'リモートワーク中'},
     'site': {'name': '現場', 'emoji': ':building_construction:', 'status': '現場で勤務中'},
 }
 
+# ステータス文字列から勤務地を判定するキーワード表（先に一致したものを採用）
+_LOCATION_KEYWORDS = (
+    ('銀座', '銀座', 'ginza'),
+    ('立川', '立川', 'tachikawa'),
+    ('リモート', 'リモートワーク', 'remote'),
+    ('現場', '現場', 'site'),
+)
+
 # Allowed email domain
 ALLOWED_DOMAIN = 'altenergy.co.jp'
+_EMAIL_SUFFIX = '@' + ALLOWED_DOMAIN
+
+# 日本標準時（HRMOSの日付・打刻時刻の算出に使用）
+JST = timezone(timedelta(hours=9))
 
 # Slack API URLs
 SLACK_AUTH_URL = 'https://slack.com/oauth/v2/authorize'
@@ -41,93 +97,271 @@ SLACK_TOKEN_URL = 'https://slack.com/api/oauth.v2.access'
 SLACK_USER_INFO_URL = 'https://slack.com/api/users.info'
 SLACK_PROFILE_SET_URL = 'https://slack.com/api/users.profile.set'
 
+# 認可URLの固定部分は起動時に組み立てておき、ログインごとの再構築を避ける
+_SLACK_AUTH_URL_TEMPLATE = (
+    f"{SLACK_AUTH_URL}"
+    f"?client_id={SLACK_CLIENT_ID}"
+    f"&user_scope=users:read,users:read.email,users.profile:write"
+    "&redirect_uri={redirect_uri}"
+)
+
+
+# ============== HTTP Session (コネクション再利用) ==============
+# requests.get/post を直接呼ぶと毎回 TCP + TLS ハンドシェイクが発生するため、
+# keep-alive の効く Session をモジュールレベルで共有する
+
+# 外部APIの応答待ちでワーカーを塞がないよう、全リクエストに接続/読み取りタイムアウトを付ける
+HTTP_TIMEOUT = (3.05, 10)
+
+
+def _make_session():
+    """リトライ付きのコネクションプールを持つ Session を作成"""
+    http_session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=20,
+        pool_maxsize=50,
+        max_retries=Retry(
+            total=3,
+            connect=2,
+            read=2,
+            status=2,
+            backoff_factor=0.25,
+            # 429 はここでリトライしない。アダプタ内で Retry-After（users.list だと
+            # 30〜60秒になることもある）を眠って待つと HTTP_TIMEOUT では抑えられず
+            # ワーカーが塞がるため、レート制限はレスポンスを見られる呼び出し側で
+            # 処理する（/status_list は古いキャッシュで応答できる）
+            status_forcelist=[502, 503, 504],
+            respect_retry_after_header=False,
+            # allowed_methods は既定（冪等メソッドのみ）のまま。POST を含めると
+            # 応答だけ失われた chat.postMessage や打刻が二重送信されうる
+            # （接続エラー時の再試行は送信前なので POST でも安全に行われる）
+        ),
+    )
+    http_session.mount('https://', adapter)
+    return http_session
+
+
+SLACK_SESSION = _make_session()
+
+# Botトークンでの呼び出し（users.list / conversations.open / chat.postMessage）は
+# 共通ヘッダーを Session 側に持たせ、呼び出しごとのヘッダーdict構築を省く
+SLACK_BOT = _make_session()
+SLACK_BOT.headers.update({
+    'Authorization': f'Bearer {SLACK_BOT_TOKEN}',
+    'Content-Type': 'application/json'
+})
+
+# HRMOS連携再開時に使用
+# HRMOS_SESSION = _make_session()
+
+# 打刻をレスポンスから切り離すためのワーカープール（連携再開時に使用）
+# from concurrent.futures import ThreadPoolExecutor
+# EXECUTOR = ThreadPoolExecutor(max_workers=4)
+#
+# ログイン時に遅延解決した HRMOS ユーザーIDの受け渡し場所
+# （slack_id -> hrmos_user_id。単一キーの代入/popのみなのでロック不要）
+# _PENDING_HRMOS = {}
+#
+# def _resolve_hrmos_id_async(email, slack_id):
+#     """HRMOSユーザーIDをバックグラウンドで解決して _PENDING_HRMOS に置く
+#
+#     slack_callback が EXECUTOR.submit でこれを投げる。セッションへの昇格は
+#     login_required 側で行う: session['user']['hrmos_user_id'] が None なら
+#     _PENDING_HRMOS.pop(user['id'], None) を確認し、あれば書き戻す。
+#     """
+#     hrmos_user = find_hrmos_user_by_email(get_hrmos_token(), email)
+#     if hrmos_user:
+#         _PENDING_HRMOS[slack_id] = hrmos_user.get('id')
+
+
+# ============== Slack ステータス更新ペイロード（起動時に構築） ==============
+# 勤務地ごとの users.profile.set ボディは固定内容なので、リクエストごとに
+# dict 構築 + JSONエンコードせず、エンコード済みバイト列を使い回す
+
+def _profile_body(status_text, status_emoji):
+    """users.profile.set 用のエンコード済みJSONボディを作成"""
+    return json.dumps({
+        'profile': {
+            'status_text': status_text,
+            'status_emoji': status_emoji,
+            'status_expiration': 0
+        }
+    }, ensure_ascii=False).encode('utf-8')
+
+
+# get_office_info がCIDRマッチで返す info からも引けるよう、オフィス名をキーにする
+OFFICE_PROFILE_BODY = {info['name']: _profile_body(info['status'], info['emoji'])
+                       for info in OFFICE_IPS.values()}
+OTHER_PROFILE_BODY = {key: _profile_body(info['status'], info['emoji'])
+                      for key, info in OTHER_LOCATIONS.items()}
+CLEAR_PROFILE_BODY = _profile_body('', '')
+
 
 # ============== HRMOS API Functions (一時停止中) ==============
+# トークンは有効期限内で再利用できるため、毎回取得せずプロセス内にTTL付きでキャッシュする
+# _HRMOS_TOKEN_CACHE = {'token': None, 'exp': 0}
+# _HRMOS_TOKEN_LOCK = threading.Lock()
+#
 # def get_hrmos_token():
-#     """HRMOS APIのトークンを取得"""
-#     try:
-#         response = requests.get(
-#             f"{HRMOS_API_BASE}/authentication/token",
-#             headers={
-#                 'Authorization': f'Basic {HRMOS_API_SECRET}',
-#                 'Content-Type': 'application/json'
-#             }
-#         )
-#         if response.status_code == 200:
-#             return response.json().get('token')
-#     except Exception as e:
-#         print(f"HRMOS token error: {e}")
+#     """HRMOS APIのトークンを取得（TTL付きキャッシュ）"""
+#     # 期限の30秒前までキャッシュを返す
+#     if time.monotonic() < _HRMOS_TOKEN_CACHE['exp'] - 30:
+#         return _HRMOS_TOKEN_CACHE['token']
+#     with _HRMOS_TOKEN_LOCK:
+#         if time.monotonic() < _HRMOS_TOKEN_CACHE['exp'] - 30:
+#             return _HRMOS_TOKEN_CACHE['token']
+#         try:
+#             response = HRMOS_SESSION.get(
+#                 f"{HRMOS_API_BASE}/authentication/token",
+#                 headers={
+#                     'Authorization': f'Basic {HRMOS_API_SECRET}',
+#                     'Content-Type': 'application/json'
+#                 },
+#                 timeout=HTTP_TIMEOUT
+#             )
+#             if response.status_code == 200:
+#                 data = response.json()
+#                 token = data.get('token')
+#                 if token:
+#                     # APIが expires_in を返すならそれに従い、無ければ5分で更新
+#                     # （期限30秒前からの再取得は上の判定が行う）
+#                     ttl = data.get('expires_in') or 300
+#                     _HRMOS_TOKEN_CACHE['token'] = token
+#                     _HRMOS_TOKEN_CACHE['exp'] = time.monotonic() + ttl
+#                 return token
+#         except requests.Timeout:
+#             logger.warning("hrmos_token_timeout")
+#         except Exception:
+#             logger.warning("hrmos_token_error", exc_info=True)
 #     return None
 #
-# def get_hrmos_users(token):
-#     """HRMOS のユーザー一覧を取得"""
-#     try:
-#         users = []
-#         page = 1
-#         while True:
-#             response = requests.get(
+# def iter_hrmos_users(token):
+#     """HRMOS のユーザーをページ単位で取得しながら逐次返すジェネレータ
+#
+#     呼び出し側が途中で打ち切れば残りページは取得されないため、
+#     1件見つければよい検索は最悪ケースでも早期に止まる。
+#     """
+#     page = 1
+#     while True:
+#         try:
+#             response = HRMOS_SESSION.get(
 #                 f"{HRMOS_API_BASE}/users",
 #                 headers={
 #                     'Authorization': f'Token {token}',
 #                     'Content-Type': 'application/json'
 #                 },
-#                 params={'limit': 100, 'page': page}
+#                 params={'limit': 100, 'page': page},
+#                 timeout=HTTP_TIMEOUT
 #             )
-#             if response.status_code == 200:
-#                 data = response.json()
-#                 if not data or len(data) == 0:
-#                     break
-#                 users.extend(data)
-#                 if len(data) < 100:
-#                     break
-#                 page += 1
-#             else:
-#                 break
-#         return users
-#     except Exception as e:
-#         print(f"HRMOS users error: {e}")
-#     return []
+#         except requests.Timeout:
+#             logger.warning("hrmos_users_timeout")
+#             return
+#         except Exception:
+#             logger.warning("hrmos_users_error", exc_info=True)
+#             return
+#         if response.status_code != 200:
+#             return
+#         data = response.json()
+#         if not data:
+#             return
+#         yield from data
+#         if len(data) < 100:
+#             return
+#         page += 1
+#
+# def get_hrmos_users(token):
+#     """HRMOS のユーザー一覧を取得"""
+#     return list(iter_hrmos_users(token))
+#
+# 社員一覧は変更が少ないため、メール→ユーザーの索引をTTL付きで保持して
+# ログインのたびに全ページを取得し直すのを避ける
+# _HRMOS_EMAIL_INDEX = {'map': {}, 'exp': 0}
+# _HRMOS_EMAIL_LOCK = threading.Lock()
+#
+# def _get_hrmos_email_index(token):
+#     """メールアドレス→HRMOSユーザーの索引を取得（1時間TTL）"""
+#     if time.monotonic() < _HRMOS_EMAIL_INDEX['exp']:
+#         return _HRMOS_EMAIL_INDEX['map']
+#     with _HRMOS_EMAIL_LOCK:
+#         if time.monotonic() < _HRMOS_EMAIL_INDEX['exp']:
+#             return _HRMOS_EMAIL_INDEX['map']
+#         users = get_hrmos_users(token)
+#         if users:
+#             _HRMOS_EMAIL_INDEX['map'] = {u['email']: u for u in users if u.get('email')}
+#             _HRMOS_EMAIL_INDEX['exp'] = time.monotonic() + 3600
+#     return _HRMOS_EMAIL_INDEX['map']
+#
+# 起動時にバックグラウンドで索引を温めておくと、初回ログインから辞書参照で済む
+# threading.Thread(
+#     target=lambda: _get_hrmos_email_index(get_hrmos_token()), daemon=True
+# ).start()
 #
 # def find_hrmos_user_by_email(token, email):
 #     """メールアドレスからHRMOSユーザーを検索"""
-#     users = get_hrmos_users(token)
-#     for user in users:
-#         if user.get('email') == email:
-#             return user
-#     return None
+#     # まずサーバー側フィルタで1件だけ問い合わせ、全ページ取得を省く
+#     try:
+#         response = HRMOS_SESSION.get(
+#             f"{HRMOS_API_BASE}/users",
+#             headers={
+#                 'Authorization': f'Token {token}',
+#                 'Content-Type': 'application/json'
+#             },
+#             params={'email': email, 'limit': 1},
+#             timeout=HTTP_TIMEOUT
+#         )
+#         if response.status_code == 200:
+#             data = response.json()
+#             # email パラメータ非対応のAPIは無視して全件ページを200で返しうるため、
+#             # 先頭要素が本当に該当ユーザーか確認してから採用する
+#             # （不一致なら下の索引フォールバックに任せる）
+#             if data and data[0].get('email') == email:
+#                 return data[0]
+#     except requests.Timeout:
+#         logger.warning("hrmos_user_search_timeout")
+#     except Exception:
+#         logger.warning("hrmos_user_search_error", exc_info=True)
+#     # フィルタ非対応・空振り時は索引（全件取得）にフォールバック
+#     return _get_hrmos_email_index(token).get(email)
 #
 # def get_today_work_output(token, user_id):
 #     """本日の勤怠データを取得"""
 #     try:
-#         jst = timezone(timedelta(hours=9))
-#         today = datetime.now(jst).strftime('%Y-%m-%d')
-#         response = requests.get(
+#         # 当日の日付文字列はリクエスト内で共有する（URLセグメント兼キャッシュキー）
+#         today = g.get('_today_jst')
+#         if today is None:
+#             today = g._today_jst = datetime.now(JST).strftime('%Y-%m-%d')
+#         response = HRMOS_SESSION.get(
 #             f"{HRMOS_API_BASE}/work_outputs/daily/{today}",
 #             headers={
 #                 'Authorization': f'Token {token}',
 #                 'Content-Type': 'application/json'
 #             },
-#             params={'limit': 100}
+#             params={'limit': 100},
+#             timeout=HTTP_TIMEOUT
 #         )
 #         if response.status_code == 200:
 #             data = response.json()
 #             for record in data:
 #                 if record.get('user_id') == user_id:
 #                     return record
-#     except Exception as e:
-#         print(f"HRMOS work output error: {e}")
+#     except requests.Timeout:
+#         logger.warning("hrmos_work_output_timeout")
+#     except Exception:
+#         logger.warning("hrmos_work_output_error", exc_info=True)
 #     return None
 #
-# def is_already_checked_in(token, hrmos_user_id):
-#     """本日既に出勤打刻済みかどうか確認"""
-#     work_output = get_today_work_output(token, hrmos_user_id)
+# def is_already_checked_in(token, hrmos_user_id, work_output=None):
+#     """本日既に出勤打刻済みかどうか確認（work_output省略時は取得する）"""
+#     if work_output is None:
+#         work_output = get_today_work_output(token, hrmos_user_id)
 #     if work_output:
 #         return work_output.get('start_at') is not None or work_output.get('stamping_start_at') is not None
 #     return False
 #
-# def is_already_checked_out(token, hrmos_user_id):
-#     """本日既に退勤打刻済みかどうか確認"""
-#     work_output = get_today_work_output(token, hrmos_user_id)
+# def is_already_checked_out(token, hrmos_user_id, work_output=None):
+#     """本日既に退勤打刻済みかどうか確認（work_output省略時は取得する）"""
+#     if work_output is None:
+#         work_output = get_today_work_output(token, hrmos_user_id)
 #     if work_output:
 #         return work_output.get('end_at') is not None or work_output.get('stamping_end_at') is not None
 #     return False
@@ -135,9 +369,9 @@ SLACK_PROFILE_SET_URL = 'https://slack.com/api/users.profile.set'
 # def hrmos_stamp(token, user_id, stamp_type):
 #     """HRMOS に打刻を登録"""
 #     try:
-#         jst = timezone(timedelta(hours=9))
-#         now = datetime.now(jst).strftime('%Y-%m-%dT%H:%M:%S+09:00')
-#         response = requests.post(
+#         # isoformat は strftime より速く、同じ +09:00 付き表記になる
+#         now = datetime.now(JST).isoformat(timespec='seconds')
+#         response = HRMOS_SESSION.post(
 #             f"{HRMOS_API_BASE}/stamp_logs",
 #             headers={
 #                 'Authorization': f'Token {token}',
@@ -147,11 +381,14 @@ SLACK_PROFILE_SET_URL = 'https://slack.com/api/users.profile.set'
 #                 'user_id': user_id,
 #                 'stamp_type': stamp_type,
 #                 'datetime': now
-#             }
+#             },
+#             timeout=HTTP_TIMEOUT
 #         )
 #         return response.status_code == 200
-#     except Exception as e:
-#         print(f"HRMOS stamp error: {e}")
+#     except requests.Timeout:
+#         logger.warning("hrmos_stamp_timeout")
+#     except Exception:
+#         logger.warning("hrmos_stamp_error", exc_info=True)
 #     return False
 # ==============================================================
 
@@ -159,15 +396,48 @@ SLACK_PROFILE_SET_URL = 'https://slack.com/api/users.profile.set'
 # ============== Helper Functions ==============
 
 def get_client_ip():
-    """クライアントのIPアドレスを取得"""
-    if request.headers.get('X-Forwarded-For'):
-        return request.headers.get('X-Forwarded-For').split(',')[0].strip()
-    return request.remote_addr
-
-
-def get_office_info(ip_address):
-    """IPアドレスからオフィス情報を取得"""
-    return OFFICE_IPS.get(ip_address)
+    """クライアントのIPアドレスを取得（リクエスト内でメモ化）
+
+    ProxyFix が X-Forwarded-For を remote_addr に反映済みのため、
+    ここでヘッダーを読む必要はない（直接アクセス時もそのまま正しい）。
+    """
+    ip = g.get('_client_ip')
+    if ip is None:
+        ip = g._client_ip = request.remote_addr
+    return ip
+
+
+@lru_cache(maxsize=1024)
+def get_office_info(ip_address_str):
+    """IPアドレスからオフィス情報を取得（CIDR対応・結果はLRUキャッシュ）"""
+    try:
+        addr = ipaddress.ip_address(ip_address_str)
+    except ValueError:
+        return None
+    # IPv4射影アドレス（::ffff:x.x.x.x）はIPv4として判定する
+    if addr.version == 6 and addr.ipv4_mapped:
+        addr = addr.ipv4_mapped
+    return next((info for net, info in _OFFICE_NETS if addr in net), None)
+
+
+# url_for(..., _external=True) はURLマップ探索とスキーム/ホストの文字列化を伴うため、
+# デプロイ中は実質固定の値をキャッシュする。生成結果はスキームにも依存する
+# （ProxyFix 適用後の http/https）ので、キーはスキーム+ホストの組にする
+_REDIRECT_URI_CACHE = {}
+_REDIRECT_URI_CACHE_MAX = 16
+
+
+def _slack_redirect_uri():
+    """slack_callback の外部URLを取得（スキーム+ホスト単位でキャッシュ）"""
+    key = (request.scheme, request.host)
+    uri = _REDIRECT_URI_CACHE.get(key)
+    if uri is None:
+        # /login は未認証で叩けるため、クライアント申告の Host で
+        # 無限に増えないよう上限で打ち切ってから入れ直す
+        if len(_REDIRECT_URI_CACHE) >= _REDIRECT_URI_CACHE_MAX:
+            _REDIRECT_URI_CACHE.clear()
+        uri = _REDIRECT_URI_CACHE[key] = url_for('slack_callback', _external=True)
+    return uri
 
 
 def login_required(f):
@@ -191,19 +461,46 @@ def login_required(f):
 #     
 #     if not hrmos_user_id:
 #         return {'checked_in': False, 'checked_out': False, 'hrmos_user_id': None}
-#     
+#
+#     # 打刻はこのアプリ自身が行うため、当日分はセッションに記録した状態を正とする。
+#     # HRMOSへの問い合わせはセッションに無い/日付が変わったときだけ行う
+#     state = session.get('hrmos_state')
+#     today = date.today().isoformat()
+#     if state and state.get('date') == today:
+#         return {
+#             'checked_in': state['checked_in'],
+#             'checked_out': state['checked_out'],
+#             'hrmos_user_id': hrmos_user_id
+#         }
+#
 #     token = get_hrmos_token()
 #     if not token:
 #         return {'checked_in': False, 'checked_out': False, 'hrmos_user_id': hrmos_user_id}
 #     
-#     checked_in = is_already_checked_in(token, hrmos_user_id)
-#     checked_out = is_already_checked_out(token, hrmos_user_id)
-#     
+#     # 同じ勤怠データを2回取得しないよう、1回だけ取得して両フラグを導出する
+#     work_output = get_today_work_output(token, hrmos_user_id)
+#     checked_in = is_already_checked_in(token, hrmos_user_id, work_output)
+#     checked_out = is_already_checked_out(token, hrmos_user_id, work_output)
+#
+#     # hrmos_stamp 成功時は呼び出し側がこのエントリの該当フラグを更新すること
+#     session['hrmos_state'] = {'date': today, 'checked_in': checked_in, 'checked_out': checked_out}
+#
 #     return {
 #         'checked_in': checked_in,
 #         'checked_out': checked_out,
 #         'hrmos_user_id': hrmos_user_id
 #     }
+#
+# def _hrmos_status():
+#     """リクエスト内で get_hrmos_status の結果を使い回す（flask.g にメモ化）
+#
+#     ハンドラはこれを通して状態を読み、打刻成功後は再取得せずに
+#     g._hrmos_status['checked_in'] = True のように該当フラグだけ更新する。
+#     """
+#     cached = g.get('_hrmos_status')
+#     if cached is None:
+#         cached = g._hrmos_status = get_hrmos_status()
+#     return cached
 # ========================================================
 
 
@@ -218,11 +515,12 @@ def index():
     user = session['user']
     client_ip = get_client_ip()
     office_info = get_office_info(client_ip)
-    
+
     # HRMOS連携停止中のため、常にNone
+    # （再開時も描画パスでは問い合わせず、/api/hrmos_status の非同期取得に任せる）
     hrmos_status = None
-    
-    return render_template('index.html', 
+
+    return render_template('index.html',
                          user=user, 
                          client_ip=client_ip,
                          office_info=office_info,
@@ -230,19 +528,23 @@ def index():
                          hrmos_status=hrmos_status)
 
 
+@app.route('/api/hrmos_status')
+@login_required
+def api_hrmos_status():
+    """HRMOS打刻状態をJSONで返す（ページ描画後の非同期取得用）
+
+    HRMOSへの問い合わせを index の描画パスから外すためのエンドポイント。
+    連携再開時は get_hrmos_status() の結果（セッションキャッシュ込み）を返す。
+    """
+    # HRMOS連携停止中のため、常にNone
+    # return {'hrmos_status': get_hrmos_status()}
+    return {'hrmos_status': None}
+
+
 @app.route('/login')
 def login():
     """Slack OAuth認証開始"""
-    redirect_uri = url_for('slack_callback', _external=True)
-    
-    auth_url = (
-        f"{SLACK_AUTH_URL}"
-        f"?client_id={SLACK_CLIENT_ID}"
-        f"&user_scope=users:read,users:read.email,users.profile:write"
-        f"&redirect_uri={redirect_uri}"
-    )
-    
-    return redirect(auth_url)
+    return redirect(_SLACK_AUTH_URL_TEMPLATE.format(redirect_uri=_slack_redirect_uri()))
 
 
 @app.route('/slack/callback')
@@ -256,16 +558,16 @@ def slack_callback():
     
     if not code:
         return "認証コードがありません", 400
-    
-    redirect_uri = url_for('slack_callback', _external=True)
+
+    redirect_uri = _slack_redirect_uri()
     
     # アクセストークンを取得
-    response = requests.post(SLACK_TOKEN_URL, data={
+    response = SLACK_SESSION.post(SLACK_TOKEN_URL, data={
         'client_id': SLACK_CLIENT_ID,
         'client_secret': SLACK_CLIENT_SECRET,
         'code': code,
         'redirect_uri': redirect_uri
-    })
+    }, timeout=HTTP_TIMEOUT)
     
     token_data = response.json()
     
@@ -278,9 +580,10 @@ def slack_callback():
     user_id = authed_user.get('id')
     
     # users.info APIでユーザー詳細を取得
-    user_info_response = requests.get(
+    user_info_response = SLACK_SESSION.get(
         f"{SLACK_USER_INFO_URL}?user={user_id}",
-        headers={'Authorization': f'Bearer {access_token}'}
+        headers={'Authorization': f'Bearer {access_token}'},
+        timeout=HTTP_TIMEOUT
     )
     
     user_info = user_info_response.json()
@@ -295,17 +598,18 @@ def slack_callback():
     email = profile.get('email', '')
     
     # メールドメインを確認
-    if email and not email.endswith(f'@{ALLOWED_DOMAIN}'):
-        return f"このアプリは @{ALLOWED_DOMAIN} のメールアドレスを持つユーザーのみ利用できます", 403
+    if email and not email.endswith(_EMAIL_SUFFIX):
+        return f"このアプリは {_EMAIL_SUFFIX} のメールアドレスを持つユーザーのみ利用できます", 403
     
     # ============== HRMOS連携停止中 ==============
-    # HRMOSユーザーIDを取得
+    # HRMOSユーザーIDの解決はチェックインまで不要なので、ログインを
+    # 遅くしないよう同期では行わない。ここでは None のままリダイレクトし、
+    # _resolve_hrmos_id_async（EXECUTOR の定義の隣）が解決結果を
+    # _PENDING_HRMOS に置く。セッションへの昇格は login_required が行う
+    # （get_hrmos_token はキャッシュ済みで O(1)。索引が温まっていれば解決も辞書参照1回）
     # hrmos_user_id = None
-    # hrmos_token = get_hrmos_token()
-    # if hrmos_token and email:
-    #     hrmos_user = find_hrmos_user_by_email(hrmos_token, email)
-    #     if hrmos_user:
-    #         hrmos_user_id = hrmos_user.get('id')
+    # if email:
+    #     EXECUTOR.submit(_resolve_hrmos_id_async, email, user_id)
     # =============================================
     
     # セッションにユーザー情報を保存
@@ -320,42 +624,30 @@ def slack_callback():
     return redirect(url_for('index'))
 
 
-@app.route('/checkin', methods=['POST'])
-@login_required
-def checkin():
-    """出勤チェックイン（オフィスから）"""
+def _do_status_update(profile_body, success_message):
+    """Slackステータスを更新して index を描画する（チェックイン・チェックアウト共通）"""
     user = session['user']
     client_ip = get_client_ip()
     office_info = get_office_info(client_ip)
-    
-    if not office_info:
-        return render_template('index.html',
-                             user=user,
-                             client_ip=client_ip,
-                             office_info=None,
-                             other_locations=OTHER_LOCATIONS,
-                             hrmos_status=None,
-                             message='現在のIPアドレスは登録されたオフィスのものではありません。下のボタンから勤務場所を選択してください。',
-                             message_type='error')
-    
+
     # Slackステータスを更新
-    slack_response = requests.post(SLACK_PROFILE_SET_URL, 
+    slack_response = SLACK_SESSION.post(SLACK_PROFILE_SET_URL,
         headers={
             'Authorization': f'Bearer {user["access_token"]}',
             'Content-Type': 'application/json'
         },
-        json={
-            'profile': {
-                'status_text': office_info['status'],
-                'status_emoji': office_info['emoji'],
-                'status_expiration': 0
-            }
-        }
+        data=profile_body,
+        timeout=HTTP_TIMEOUT
     )
-    
+
     slack_result = slack_response.json()
-    
+
     # ============== HRMOS連携停止中 ==============
+    # 再開時は Slack 更新と HRMOS 打刻が独立なので、直列に待たず
+    # ThreadPoolExecutor に両方 submit して result() で合流させる
+    # （体感レイテンシが2往復分→1往復分になる）
+    # 打刻結果を応答に載せないなら EXECUTOR.submit(hrmos_stamp, token, uid, 1) で
+    # 完全に裏へ逃がし、「HRMOS打刻中」を楽観表示して即レスポンスを返す
     # HRMOS打刻（未打刻の場合のみ）
     # hrmos_message = ""
     # if user.get('hrmos_user_id') and not hrmos_status['checked_in']:
@@ -368,14 +660,14 @@ def checkin():
     # elif hrmos_status['checked_in']:
     #     hrmos_message = " / 勤務地を更新しました"
     # =============================================
-    
+
     if slack_result.get('ok'):
-        message = f"{office_info['name']}で出勤しました"
+        message = success_message
         message_type = 'success'
     else:
         message = f"ステータス更新エラー: {slack_result.get('error')}"
         message_type = 'error'
-    
+
     return render_template('index.html',
                          user=user,
                          client_ip=client_ip,
@@ -386,110 +678,53 @@ def checkin():
                          message_type=message_type)
 
 
+@app.route('/checkin', methods=['POST'])
+@login_required
+def checkin():
+    """出勤チェックイン（オフィスから）"""
+    client_ip = get_client_ip()
+    office_info = get_office_info(client_ip)
+
+    if not office_info:
+        return render_template('index.html',
+                             user=session['user'],
+                             client_ip=client_ip,
+                             office_info=None,
+                             other_locations=OTHER_LOCATIONS,
+                             hrmos_status=None,
+                             message='現在のIPアドレスは登録されたオフィスのものではありません。下のボタンから勤務場所を選択してください。',
+                             message_type='error')
+
+    return _do_status_update(OFFICE_PROFILE_BODY[office_info['name']],
+                             f"{office_info['name']}で出勤しました")
+
+
 @app.route('/checkin_other', methods=['POST'])
 @login_required
 def checkin_other():
     """オフィス外からのチェックイン（リモート・現場）"""
-    user = session['user']
-    client_ip = get_client_ip()
-    office_info = get_office_info(client_ip)
-    
     location_type = request.form.get('location_type')
-    
+
     if location_type not in OTHER_LOCATIONS:
         return render_template('index.html',
-                             user=user,
-                             client_ip=client_ip,
-                             office_info=office_info,
+                             user=session['user'],
+                             client_ip=get_client_ip(),
+                             office_info=get_office_info(get_client_ip()),
                              other_locations=OTHER_LOCATIONS,
                              hrmos_status=None,
                              message='無効な勤務場所が選択されました',
                              message_type='error')
-    
+
     location_info = OTHER_LOCATIONS[location_type]
-    
-    # Slackステータスを更新
-    slack_response = requests.post(SLACK_PROFILE_SET_URL, 
-        headers={
-            'Authorization': f'Bearer {user["access_token"]}',
-            'Content-Type': 'application/json'
-        },
-        json={
-            'profile': {
-                'status_text': location_info['status'],
-                'status_emoji': location_info['emoji'],
-                'status_expiration': 0
-            }
-        }
-    )
-    
-    slack_result = slack_response.json()
-    
-    # ============== HRMOS連携停止中 ==============
-    # HRMOS打刻
-    # =============================================
-    
-    if slack_result.get('ok'):
-        message = f"{location_info['name']}で出勤しました"
-        message_type = 'success'
-    else:
-        message = f"ステータス更新エラー: {slack_result.get('error')}"
-        message_type = 'error'
-    
-    return render_template('index.html',
-                         user=user,
-                         client_ip=client_ip,
-                         office_info=office_info,
-                         other_locations=OTHER_LOCATIONS,
-                         hrmos_status=None,
-                         message=message,
-                         message_type=message_type)
+    return _do_status_update(OTHER_PROFILE_BODY[location_type],
+                             f"{location_info['name']}で出勤しました")
 
 
 @app.route('/checkout', methods=['POST'])
 @login_required
 def checkout():
-    """退勤チェックアウト"""
-    user = session['user']
-    client_ip = get_client_ip()
-    office_info = get_office_info(client_ip)
-    
-    # Slackステータスをクリア
-    slack_response = requests.post(SLACK_PROFILE_SET_URL,
-        headers={
-            'Authorization': f'Bearer {user["access_token"]}',
-            'Content-Type': 'application/json'
-        },
-        json={
-            'profile': {
-                'status_text': '',
-                'status_emoji': '',
-                'status_expiration': 0
-            }
-        }
-    )
-    
-    slack_result = slack_response.json()
-    
-    # ============== HRMOS連携停止中 ==============
-    # HRMOS退勤打刻
-    # =============================================
-    
-    if slack_result.get('ok'):
-        message = '退勤しました。お疲れ様でした！'
-        message_type = 'success'
-    else:
-        message = f"ステータス更新エラー: {slack_result.get('error')}"
-        message_type = 'error'
-    
-    return render_template('index.html',
-                         user=user,
-                         client_ip=client_ip,
-                         office_info=office_info,
-                         other_locations=OTHER_LOCATIONS,
-                         hrmos_status=None,
-                         message=message,
-                         message_type=message_type)
+    """退勤チェックアウト（ステータスをクリア）"""
+    return _do_status_update(CLEAR_PROFILE_BODY, '退勤しました。お疲れ様でした！')
 
 
 @app.route('/logout')
@@ -520,25 +755,22 @@ def test_checkin():
     
     # 勤務地情報を取得
     if location == 'ginza':
-        location_info = OFFICE_IPS.get('39.110.215.6')
+        office_ip = '39.110.215.6'
     elif location == 'tachikawa':
-        location_info = OFFICE_IPS.get('143.189.212.172')
+        office_ip = '143.189.212.172'
     else:
         return redirect(url_for('test_view'))
-    
+
+    location_info = OFFICE_IPS[office_ip]
+
     # Slackステータスを更新
-    slack_response = requests.post(SLACK_PROFILE_SET_URL, 
+    slack_response = SLACK_SESSION.post(SLACK_PROFILE_SET_URL,
         headers={
             'Authorization': f'Bearer {user["access_token"]}',
             'Content-Type': 'application/json'
         },
-        json={
-            'profile': {
-                'status_text': location_info['status'],
-                'status_emoji': location_info['emoji'],
-                'status_expiration': 0
-            }
-        }
+        data=OFFICE_PROFILE_BODY[location_info['name']],
+        timeout=HTTP_TIMEOUT
     )
     
     slack_result = slack_response.json()
@@ -558,58 +790,104 @@ def test_checkin():
                          message_type=message_type)
 
 
+# users.list はレート制限が厳しく（Tier 2）、内容も分単位では変わらないため、
+# 短いTTLでキャッシュして /status_list の再読込のたびに Slack を叩かない
+_USERS_LIST_CACHE = {'members': None, 'exp': 0}
+_USERS_LIST_LOCK = threading.Lock()
+USERS_LIST_TTL = 45
+
+
+def _eligible_member(member):
+    """ステータス一覧の表示対象か（Bot・削除済み・社外メールを除外）"""
+    if member.get('is_bot') or member.get('deleted'):
+        return False
+    return member.get('profile', {}).get('email', '').endswith(_EMAIL_SUFFIX)
+
+
+def _get_slack_members():
+    """Slackの表示対象メンバー一覧を取得（45秒TTLキャッシュ）
+
+    (members, error) を返す。カーソルページングで取得しながら表示対象だけに
+    絞るため、保持するのは社内メンバー分のみ。レート制限時は Retry-After の間、
+    手元の古いキャッシュでしのぐ。
+    """
+    if time.monotonic() < _USERS_LIST_CACHE['exp']:
+        return _USERS_LIST_CACHE['members'], None
+    with _USERS_LIST_LOCK:
+        if time.monotonic() < _USERS_LIST_CACHE['exp']:
+            return _USERS_LIST_CACHE['members'], None
+
+        members = []
+        cursor = None
+        while True:
+            params = {'limit': 200}
+            if cursor:
+                params['cursor'] = cursor
+            try:
+                users_response = SLACK_BOT.get(
+                    'https://slack.com/api/users.list',
+                    params=params,
+                    timeout=HTTP_TIMEOUT
+                )
+                users_data = users_response.json()
+            except requests.RequestException as e:
+                # タイムアウトや接続断でも、手元にキャッシュがあればそれでしのぐ
+                logger.warning("slack_users_list_error", exc_info=True)
+                if _USERS_LIST_CACHE['members'] is not None:
+                    _USERS_LIST_CACHE['exp'] = time.monotonic() + USERS_LIST_TTL
+                    return _USERS_LIST_CACHE['members'], None
+                return None, type(e).__name__
+
+            if not users_data.get('ok'):
+                if users_data.get('error') == 'ratelimited' and _USERS_LIST_CACHE['members'] is not None:
+                    # Retry-After は HTTP-date 形式のこともあるため、秒数として
+                    # 読めない値は既定TTLに落とす
+                    try:
+                        retry_after = int(users_response.headers.get('Retry-After', ''))
+                    except ValueError:
+                        retry_after = USERS_LIST_TTL
+                    _USERS_LIST_CACHE['exp'] = time.monotonic() + retry_after
+                    return _USERS_LIST_CACHE['members'], None
+                return None, users_data.get('error')
+
+            members.extend(m for m in users_data.get('members', []) if _eligible_member(m))
+            cursor = users_data.get('response_metadata', {}).get('next_cursor')
+            if not cursor:
+                break
+
+        _USERS_LIST_CACHE['members'] = members
+        _USERS_LIST_CACHE['exp'] = time.monotonic() + USERS_LIST_TTL
+        return members, None
+
+
 @app.route('/status_list')
 @login_required
 def status_list():
     """全ユーザーのSlackステータス一覧"""
-    
-    # Bot Tokenで全ユーザーを取得
-    users_response = requests.get(
-        'https://slack.com/api/users.list',
-        headers={'Authorization': f'Bearer {SLACK_BOT_TOKEN}'}
-    )
-    
-    users_data = users_response.json()
-    
-    if not users_data.get('ok'):
-        return f"ユーザー一覧取得エラー: {users_data.get('error')}", 400
-    
-    # ユーザー情報を整理
+
+    # Bot Tokenで全ユーザーを取得（キャッシュ込み）
+    members, error = _get_slack_members()
+
+    if members is None:
+        return f"ユーザー一覧取得エラー: {error}", 400
+
+    # ユーザー情報を整理（Bot・削除済み・社外メールは取得時に除外済み）
     user_statuses = []
-    for member in users_data.get('members', []):
-        # Botや削除済みユーザーは除外
-        if member.get('is_bot') or member.get('deleted'):
-            continue
-        
+    for member in members:
         profile = member.get('profile', {})
-        
-        # @altenergy.co.jp のユーザーのみ表示
         email = profile.get('email', '')
-        if not email.endswith('@altenergy.co.jp'):
-            continue
-        
         status_text = profile.get('status_text', '')
         status_emoji = profile.get('status_emoji', '')
         
-        # ステータスから勤務地を判定
+        # ステータスから勤務地を判定（キーワード表を1周するだけ）
         location = '未設定'
         location_class = 'unknown'
-        if '銀座' in status_text:
-            location = '銀座'
-            location_class = 'ginza'
-        elif '立川' in status_text:
-            location = '立川'
-            location_class = 'tachikawa'
-        elif 'リモート' in status_text:
-            location = 'リモートワーク'
-            location_class = 'remote'
-        elif '現場' in status_text:
-            location = '現場'
-            location_class = 'site'
-        elif status_text:
-            location = '未設定'
-            location_class = 'unknown'
-        
+        for keyword, loc, cls in _LOCATION_KEYWORDS:
+            if keyword in status_text:
+                location, location_class = loc, cls
+                break
+
+
         user_statuses.append({
             'slack_id': member.get('id'),
             'name': member.get('real_name') or member.get('name', ''),
@@ -622,7 +900,7 @@ def status_list():
         })
     
     # 名前順でソート
-    user_statuses.sort(key=lambda x: x['name'])
+    user_statuses.sort(key=itemgetter('name'))
     
     return render_template('status_list.html', users=user_statuses)
 
@@ -638,13 +916,10 @@ def send_dm():
         return {'success': False, 'error': '送信先が指定されていません'}, 400
     
     # DMチャンネルを開く
-    open_response = requests.post(
+    open_response = SLACK_BOT.post(
         'https://slack.com/api/conversations.open',
-        headers={
-            'Authorization': f'Bearer {SLACK_BOT_TOKEN}',
-            'Content-Type': 'application/json'
-        },
-        json={'users': target_user_id}
+        json={'users': target_user_id},
+        timeout=HTTP_TIMEOUT
     )
     
     open_data = open_response.json()
@@ -658,16 +933,13 @@ def send_dm():
     sender_name = sender.get('name', '誰か')
     message = f"{sender_name}より、呼び出しがありました。"
     
-    msg_response = requests.post(
+    msg_response = SLACK_BOT.post(
         'https://slack.com/api/chat.postMessage',
-        headers={
-            'Authorization': f'Bearer {SLACK_BOT_TOKEN}',
-            'Content-Type': 'application/json'
-        },
         json={
             'channel': channel_id,
             'text': message
-        }
+        },
+        timeout=HTTP_TIMEOUT
     )
     
     msg_data = msg_response.json()